@@ -2,15 +2,20 @@
 import sys
 import io
 import os
-import re
+import math
+import time
+import functools
+import asyncio
+import httpx
 import pandas as pd
 from playwright.sync_api import sync_playwright
-from sqlalchemy import create_engine, Column, String, Float, Integer
+from sqlalchemy import create_engine, event, update, Column, String, Float, Integer
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
 import matplotlib.image as mpimg
 from matplotlib.offsetbox import OffsetImage, AnnotationBbox
+from ebus_parser import ROUTE_LIST_RE, STOP_PLACE_SELECTOR, STOP_PLACES_JS, STOP_PLACES_CHANGED_JS, parse_stops_of_route
 
 # 設定輸出編碼為 UTF-8
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
@@ -20,43 +25,171 @@ import matplotlib
 matplotlib.rcParams['font.sans-serif'] = ['Microsoft JhengHei']  # 使用微軟正黑體顯示中文
 matplotlib.rcParams['axes.unicode_minus'] = False  # 正確顯示負號
 
+# 公車與人物圖片在載入模組時解碼一次，每張路線圖直接重用
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_BUS_IMG = mpimg.imread(os.path.join(_BASE_DIR, '公車.png'))
+_PERSON_IMG = mpimg.imread(os.path.join(_BASE_DIR, '人.jpg'))
+
+HTTP_HEADERS = {"User-Agent": "Mozilla/5.0"}
+STOPS_OF_ROUTE_URL = 'https://ebus.gov.taipei/Route/StopsOfRoute?routeid={route_id}'
+
+# HTML 快取有效秒數：路線列表很少變動；站點頁面含即時到站資訊，只短暫快取
+ROUTE_LIST_CACHE_TTL = 24 * 60 * 60
+ROUTE_INFO_CACHE_TTL = 60
+
+
+Base = declarative_base()
+
+
+class bus_route_orm(Base):
+    __tablename__ = 'data_route_list'
+    route_id = Column(String, primary_key=True)
+    route_name = Column(String)
+    route_data_updated = Column(Integer, default=0)
+
+
+class bus_stop_orm(Base):
+    __tablename__ = "data_route_info_busstop"
+    stop_id = Column(Integer)
+    arrival_info = Column(String)
+    stop_number = Column(Integer, primary_key=True)
+    stop_name = Column(String)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    direction = Column(String, primary_key=True)
+    route_id = Column(String, primary_key=True)
+
+
+Session = sessionmaker()
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL 加上 synchronous=NORMAL，commit 時不必每次 fsync 整個資料庫檔
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+@functools.lru_cache(maxsize=None)
+def get_engine(working_directory: str = 'data'):
+    """
+    每個工作目錄只建立一次 engine 並建立資料表，之後所有路線共用。
+    """
+    engine = create_engine(f'sqlite:///{working_directory}/hermes_ebus_taipei.sqlite3')
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def route_info_cache_path(working_directory: str, route_id: str, direction: str) -> str:
+    return f"{working_directory}/ebus_taipei_{route_id}_{direction}.html"
+
+
+def cache_is_fresh(path: str, ttl: float) -> bool:
+    return os.path.exists(path) and time.time() - os.path.getmtime(path) < ttl
+
+
+def fetch_html(url: str, http_client: httpx.Client = None) -> str:
+    """
+    頁面由伺服器端產生，直接以 HTTP GET 取得 HTML，不需啟動瀏覽器。
+    """
+    if http_client is None:
+        with httpx.Client(headers=HTTP_HEADERS, follow_redirects=True, timeout=10) as client:
+            return fetch_html(url, client)
+    response = http_client.get(url)
+    response.raise_for_status()
+    return response.text
+
+
+async def fetch_routes_html(route_ids: list, concurrency: int = 8) -> dict:
+    """
+    以 asyncio 同時抓取多條路線的站點頁面，Semaphore 限制同時連線數以免對伺服器造成負擔。
+    回傳 {route_id: HTML}，抓取失敗的路線對應到其例外物件。
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(headers=HTTP_HEADERS, follow_redirects=True, timeout=10) as client:
+        async def fetch_one(route_id):
+            async with semaphore:
+                response = await client.get(STOPS_OF_ROUTE_URL.format(route_id=route_id))
+                response.raise_for_status()
+                return response.text
+
+        pages = await asyncio.gather(*(fetch_one(route_id) for route_id in route_ids), return_exceptions=True)
+    return dict(zip(route_ids, pages))
+
+
+class BrowserPool:
+    """
+    共用同一個 Chromium 與 browser context，多次抓取只需啟動一次瀏覽器。
+    """
+    def __init__(self, headless: bool = True):
+        self._playwright = sync_playwright().start()
+        self.browser = self._playwright.chromium.launch(headless=headless)
+        self.context = self.browser.new_context()
+
+    def new_page(self):
+        return self.context.new_page()
+
+    def close(self):
+        self.context.close()
+        self.browser.close()
+        self._playwright.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 class taipei_route_list:
-    def __init__(self, working_directory='data'):
+    def __init__(self, working_directory='data', browser_pool: BrowserPool = None,
+                 http_client: httpx.Client = None, use_browser: bool = False, force_refresh: bool = False):
         self.working_directory = working_directory
+        self.browser_pool = browser_pool
+        self.http_client = http_client
+        self.use_browser = use_browser
+        self.force_refresh = force_refresh
         os.makedirs(self.working_directory, exist_ok=True)
         self.url = 'https://ebus.gov.taipei/ebus?ct=all'
+        self.cache_path = f'{self.working_directory}/hermes_ebus_taipei_route_list.html'
         self.content = None
         self._fetch_content()
 
-        Base = declarative_base()
-
-        class bus_route_orm(Base):
-            __tablename__ = 'data_route_list'
-            route_id = Column(String, primary_key=True)
-            route_name = Column(String)
-            route_data_updated = Column(Integer, default=0)
-
         self.orm = bus_route_orm
-        self.engine = create_engine(f'sqlite:///{self.working_directory}/hermes_ebus_taipei.sqlite3')
-        self.engine.connect()
-        Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        self.engine = get_engine(self.working_directory)
+        self.session = Session(bind=self.engine)
 
     def _fetch_content(self):
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
+        if not self.force_refresh and cache_is_fresh(self.cache_path, ROUTE_LIST_CACHE_TTL):
+            with open(self.cache_path, encoding="utf-8") as file:
+                self.content = file.read()
+            return
+        if self.use_browser:
+            self._fetch_content_with_browser()
+        else:
+            self.content = fetch_html(self.url, self.http_client)
+        with open(self.cache_path, "w", encoding="utf-8") as file:
+            file.write(self.content)
+
+    def _fetch_content_with_browser(self):
+        # 未傳入 browser_pool 時，臨時啟動一個只給這次抓取使用
+        pool = self.browser_pool or BrowserPool()
+        page = pool.new_page()
+        try:
             page.goto(self.url)
-            page.wait_for_timeout(3000)
+            page.wait_for_selector('li a[href^="javascript:go"]', state='attached', timeout=10000)
             self.content = page.content()
-            browser.close()
-        with open(f'{self.working_directory}/hermes_ebus_taipei_route_list.html', "w", encoding="utf-8") as file:
-            file.write(self.content)
+        finally:
+            page.close()
+            if self.browser_pool is None:
+                pool.close()
 
     def parse_route_list(self) -> pd.DataFrame:
-        pattern = r'<li><a href="javascript:go\(\'(.*?)\'\)">(.*?)</a></li>'
-        matches = re.findall(pattern, self.content, re.DOTALL)
+        matches = ROUTE_LIST_RE.findall(self.content)
         if not matches:
             raise ValueError("No data found for route table")
         bus_routes = [(route_id, route_name.strip()) for route_id, route_name in matches]
@@ -64,9 +197,15 @@ class taipei_route_list:
         return self.dataframe
 
     def save_to_database(self):
-        for _, row in self.dataframe.iterrows():
-            self.session.merge(self.orm(route_id=row['route_id'], route_name=row['route_name']))
-        self.session.commit()
+        # 一次 executemany 批次寫入；已存在的路線只更新名稱，保留 route_data_updated 狀態
+        records = self.dataframe.to_dict(orient="records")
+        stmt = sqlite_insert(self.orm.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["route_id"],
+            set_={"route_name": stmt.excluded.route_name}
+        )
+        with self.engine.begin() as conn:
+            conn.execute(stmt, records)
 
     def read_from_database(self) -> pd.DataFrame:
         query = self.session.query(self.orm)
@@ -81,162 +220,179 @@ class taipei_route_list:
         self.session.query(self.orm).filter_by(route_id=route_id).update({"route_data_updated": 2})
         self.session.commit()
 
+    def set_routes_data_updated(self, updated_ids: list, failed_ids: list = ()):
+        # 整批路線各用一次 UPDATE ... WHERE route_id IN (...)，最後只 commit 一次
+        for route_ids, route_data_updated in ((updated_ids, 1), (failed_ids, 2)):
+            if route_ids:
+                self.session.execute(
+                    update(self.orm).where(self.orm.route_id.in_(route_ids)).values(route_data_updated=route_data_updated)
+                )
+        self.session.commit()
+
     def __del__(self):
+        # engine 由 get_engine 共用，這裡只關閉自己的 session
         self.session.close()
-        self.engine.dispose()
 
 
 class taipei_route_info:
-    def __init__(self, route_id: str, direction: str = 'go', working_directory: str = 'data'):
+    def __init__(self, route_id: str, direction: str = 'go', working_directory: str = 'data',
+                 browser_pool: BrowserPool = None, http_client: httpx.Client = None, use_browser: bool = False,
+                 content: str = None, force_refresh: bool = False):
         self.route_id = route_id
         self.direction = direction
         self.working_directory = working_directory
+        self.browser_pool = browser_pool
+        self.http_client = http_client
+        self.use_browser = use_browser
+        self.force_refresh = force_refresh
         os.makedirs(self.working_directory, exist_ok=True)
-        self.url = f'https://ebus.gov.taipei/Route/StopsOfRoute?routeid={route_id}'
+        self.url = STOPS_OF_ROUTE_URL.format(route_id=route_id)
         if self.direction not in ['go', 'come']:
             raise ValueError("Direction must be 'go' or 'come'")
-        self._fetch_content()
+        self.cache_path = route_info_cache_path(self.working_directory, self.route_id, self.direction)
+        # 已預先抓好的 HTML（例如 fetch_routes_html 的結果）可直接傳入，不再重複抓取
+        self.content = content
+        if self.content is None:
+            self._fetch_content()
+        else:
+            self._write_cache()
 
     def _fetch_content(self):
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
+        if not self.force_refresh and cache_is_fresh(self.cache_path, ROUTE_INFO_CACHE_TTL):
+            with open(self.cache_path, encoding="utf-8") as file:
+                self.content = file.read()
+            return
+        # 回程需要點擊頁面上的按鈕切換，只能交給瀏覽器處理
+        if self.use_browser or self.direction == 'come':
+            self._fetch_content_with_browser()
+        else:
+            self.content = fetch_html(self.url, self.http_client)
+        self._write_cache()
+
+    def _write_cache(self):
+        with open(self.cache_path, "w", encoding="utf-8") as file:
+            file.write(self.content)
+
+    def _fetch_content_with_browser(self):
+        pool = self.browser_pool or BrowserPool()
+        page = pool.new_page()
+        try:
             page.goto(self.url)
+            page.wait_for_selector('span.auto-list-stationlist-number', state='attached', timeout=10000)
             if self.direction == 'come':
+                # 等整串站名換掉才算切換到回程；逾時會丟出例外，不會把去程存成回程
+                before = page.evaluate(STOP_PLACES_JS, STOP_PLACE_SELECTOR)
                 page.click('a.stationlist-come-go-gray.stationlist-come')
-            page.wait_for_timeout(3000)
+                page.wait_for_function(STOP_PLACES_CHANGED_JS, arg=[STOP_PLACE_SELECTOR, before], timeout=10000)
             self.content = page.content()
-            browser.close()
+        finally:
+            page.close()
+            if self.browser_pool is None:
+                pool.close()
 
     def parse_route_info(self) -> pd.DataFrame:
-        pattern = re.compile(
-            r'<li>.*?<span class="auto-list-stationlist-position.*?">(.*?)</span>\s*'
-            r'<span class="auto-list-stationlist-number">\s*(\d+)</span>\s*'
-            r'<span class="auto-list-stationlist-place">(.*?)</span>.*?'
-            r'<input[^>]+name="item\.UniStopId"[^>]+value="(\d+)"[^>]*>.*?'
-            r'<input[^>]+name="item\.Latitude"[^>]+value="([\d\.]+)"[^>]*>.*?'
-            r'<input[^>]+name="item\.Longitude"[^>]+value="([\d\.]+)"[^>]*>',
-            re.DOTALL
-        )
-        matches = pattern.findall(self.content)
-        if not matches:
+        rows = parse_stops_of_route(self.content)
+        if not rows:
             raise ValueError(f"No data found for route ID {self.route_id}")
 
         self.dataframe = pd.DataFrame(
-            matches,
+            rows,
             columns=["arrival_info", "stop_number", "stop_name", "stop_id", "latitude", "longitude"]
         )
+        # 建立時一次轉型，之後繪圖與寫入資料庫都直接使用數值欄位
+        self.dataframe = self.dataframe.astype({
+            "latitude": "float64", "longitude": "float64", "stop_number": "int32", "stop_id": "int64"
+        })
         self.dataframe["direction"] = self.direction
         self.dataframe["route_id"] = self.route_id
         return self.dataframe
 
     def save_to_database(self):
-        db_file = f"{self.working_directory}/hermes_ebus_taipei.sqlite3"
-        engine = create_engine(f"sqlite:///{db_file}")
-        Base = declarative_base()
-
-        class bus_stop_orm(Base):
-            __tablename__ = "data_route_info_busstop"
-            stop_id = Column(Integer)
-            arrival_info = Column(String)
-            stop_number = Column(Integer, primary_key=True)
-            stop_name = Column(String)
-            latitude = Column(Float)
-            longitude = Column(Float)
-            direction = Column(String, primary_key=True)
-            route_id = Column(String, primary_key=True)
-
-        Base.metadata.create_all(engine)
-        Session = sessionmaker(bind=engine)
-        session = Session()
-
-        for _, row in self.dataframe.iterrows():
-            session.merge(bus_stop_orm(
-                stop_id=row["stop_id"],
-                arrival_info=row["arrival_info"],
-                stop_number=row["stop_number"],
-                stop_name=row["stop_name"],
-                latitude=row["latitude"],
-                longitude=row["longitude"],
-                direction=row["direction"],
-                route_id=row["route_id"]
-            ))
-
-        session.commit()
-        session.close()
+        # 以 INSERT ... ON CONFLICT DO UPDATE 批次寫入，取代逐筆 session.merge
+        key_columns = ("stop_number", "direction", "route_id")
+        records = self.dataframe.to_dict(orient="records")
+        stmt = sqlite_insert(bus_stop_orm.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={c.name: c for c in stmt.excluded if c.name not in key_columns}
+        )
+        with get_engine(self.working_directory).begin() as conn:
+            conn.execute(stmt, records)
 
     def plot_route_map(self, output_path: str, person_stop_number: int):
-        df = self.dataframe.copy()
-        latitudes = df["latitude"].astype(float)
-        longitudes = df["longitude"].astype(float)
-
-        fig = plt.figure(figsize=(10, 8))
-        m = Basemap(projection='merc',
-                    llcrnrlat=min(latitudes) - 0.01,
-                    urcrnrlat=max(latitudes) + 0.01,
-                    llcrnrlon=min(longitudes) - 0.01,
-                    urcrnrlon=max(longitudes) + 0.01,
-                    resolution='i')
-
-        m.drawmapboundary(fill_color='lightblue')
-        m.fillcontinents(color='lightgray', lake_color='lightblue')
-        m.drawcoastlines()
-        m.drawrivers()
-
-        x, y = m(longitudes.values, latitudes.values)
-        m.plot(x, y, marker='o', color='red', linewidth=2)
-
-        # 讀取公車圖片
-        bus_img = mpimg.imread(r'C:\Users\User\Documents\GitHub\cycu_oop_11022221\公車.png')
-        # 讀取人物圖片
-        person_img = mpimg.imread(r'C:\Users\User\Documents\GitHub\cycu_oop_11022221\人.jpg')
-
-        # 添加公車圖片到「進站中」的站點
-        for xi, yi, arrival_info in zip(x, y, df['arrival_info']):
-            if '進站中' in arrival_info:  # 假設進站中這個詞存在於 arrival_info 中
-                ab = AnnotationBbox(OffsetImage(bus_img, zoom=0.1), (xi, yi), frameon=False)
-                plt.gca().add_artist(ab)
-
-        # 只在站序為 70 的站點顯示人物圖片
-        for xi, yi, stop_number in zip(x, y, df['stop_number']):
-            if stop_number == person_stop_number:  # 只在站序 70 顯示人物圖片
-                ab = AnnotationBbox(OffsetImage(person_img, zoom=0.1), (xi, yi), frameon=False)
-                plt.gca().add_artist(ab)
+        df = self.dataframe
+        latitudes = df["latitude"].values
+        longitudes = df["longitude"].values
+
+        # 一條市區公車路線只跨約 0.1 度，直接畫在經緯度座標上，不需要 Basemap 的海岸線與河流
+        fig, ax = plt.subplots(figsize=(10, 8))
+        x, y = longitudes, latitudes
+        ax.plot(x, y, marker='o', color='red', linewidth=2)
+        ax.set_xlim(x.min() - 0.01, x.max() + 0.01)
+        ax.set_ylim(y.min() - 0.01, y.max() + 0.01)
+        # 依緯度修正經度方向的比例，讓路線形狀不被拉伸
+        ax.set_aspect(1 / math.cos(math.radians(y.mean())))
+        ax.set_facecolor('lightgray')
+
+        # 添加公車圖片到「進站中」的站點（假設進站中這個詞存在於 arrival_info 中）
+        arriving = df['arrival_info'].str.contains('進站中', regex=False).to_numpy()
+        for xi, yi in zip(x[arriving], y[arriving]):
+            ax.add_artist(AnnotationBbox(OffsetImage(_BUS_IMG, zoom=0.1), (xi, yi), frameon=False))
+
+        # 只在指定站序的站點顯示人物圖片
+        at_person_stop = df['stop_number'].eq(person_stop_number).to_numpy()
+        for xi, yi in zip(x[at_person_stop], y[at_person_stop]):
+            ax.add_artist(AnnotationBbox(OffsetImage(_PERSON_IMG, zoom=0.1), (xi, yi), frameon=False))
 
         # 在每個站點顯示站名與進站時間
-        for xi, yi, name, arrival_info in zip(x, y, df['stop_name'], df['arrival_info']):
-            plt.text(xi, yi, f"{name}\n{arrival_info}", fontsize=9, ha='left', va='bottom')
+        for xi, yi, r in zip(x, y, df.itertuples(index=False)):
+            plt.text(xi, yi, f"{r.stop_name}\n{r.arrival_info}", fontsize=9, ha='left', va='bottom')
 
         plt.title(f"Route Map: {self.route_id} ({self.direction})", fontsize=15)
-        plt.savefig(output_path, dpi=300)
+        plt.savefig(output_path, dpi=150)
         plt.close()
 
 
 if __name__ == "__main__":
-    route_list = taipei_route_list()
-    route_list.parse_route_list()
-    route_list.save_to_database()
-
-    bus1 = '0161000900'  # 承德幹線
-    bus_list = [bus1]
-
-    for route_id in bus_list:
-        try:
-            route_info = taipei_route_info(route_id, direction="go")
-            route_info.parse_route_info()
-            route_info.save_to_database()
-
-            for index, row in route_info.dataframe.iterrows():
-                print(f"站序: {row['stop_number']}, 名稱: {row['stop_name']}, 緯度: {row['latitude']}, 經度: {row['longitude']}")
-
-            # 站序 70 顯示人物圖片
-            person_stop_number = 70
-            map_path = f"data/route_{route_id}_go.png"
-            route_info.plot_route_map(map_path, person_stop_number)
-            print(f"✅ 路線圖已儲存：{map_path}")
-
-            route_list.set_route_data_updated(route_id)
-
-        except Exception as e:
-            print(f"❌ 處理路線 {route_id} 發生錯誤: {e}")
-            route_list.set_route_data_unexcepted(route_id)
+    # 整個流程共用同一個 HTTP 連線，最後統一關閉
+    with httpx.Client(headers=HTTP_HEADERS, follow_redirects=True, timeout=10) as http_client:
+        route_list = taipei_route_list(http_client=http_client)
+        route_list.parse_route_list()
+        route_list.save_to_database()
+
+        bus1 = '0161000900'  # 承德幹線
+        bus_list = [bus1]
+
+        # 快取過期的路線站點頁面並行抓取，之後再依序解析與寫入
+        stale_routes = [
+            route_id for route_id in bus_list
+            if not cache_is_fresh(route_info_cache_path('data', route_id, 'go'), ROUTE_INFO_CACHE_TTL)
+        ]
+        route_pages = asyncio.run(fetch_routes_html(stale_routes))
+
+        updated_ids, failed_ids = [], []
+        for route_id in bus_list:
+            try:
+                page_html = route_pages.get(route_id)  # 不在 route_pages 中代表快取仍有效
+                if isinstance(page_html, Exception):
+                    raise page_html
+                route_info = taipei_route_info(route_id, direction="go", content=page_html)
+                route_info.parse_route_info()
+                route_info.save_to_database()
+
+                for r in route_info.dataframe.itertuples(index=False):
+                    print(f"站序: {r.stop_number}, 名稱: {r.stop_name}, 緯度: {r.latitude}, 經度: {r.longitude}")
+
+                # 站序 70 顯示人物圖片
+                person_stop_number = 70
+                map_path = f"data/route_{route_id}_go.png"
+                route_info.plot_route_map(map_path, person_stop_number)
+                print(f"✅ 路線圖已儲存：{map_path}")
+
+                updated_ids.append(route_id)
+
+            except Exception as e:
+                print(f"❌ 處理路線 {route_id} 發生錯誤: {e}")
+                failed_ids.append(route_id)
+
+        route_list.set_routes_data_updated(updated_ids, failed_ids)
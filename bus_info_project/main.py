@@ -3,20 +3,36 @@ import pandas as pd
 class BusRouteFinder:
     def __init__(self, csv_file):
         """初始化，讀取靜態資料 (HW2.csv)"""
-        self.df = pd.read_csv(csv_file)
+        # 整份資料先依路線、方向、站序排序一次，groupby 會保留組內順序
+        self.df = pd.read_csv(csv_file).sort_values(
+            ['route_name', 'direction_text', 'stop_number']
+        ).reset_index(drop=True)
+        # 每條路線（含方向）依站序排好的站名只需建立一次，查詢時直接重用
+        self.by_route = {
+            (route_name, direction): group['stop_name'].reset_index(drop=True)
+            for (route_name, direction), group in self.df.groupby(['route_name', 'direction_text'])
+        }
+        # 反向索引：站名 -> 經過該站的 (路線, 方向)，查詢時只需檢查同時經過兩站的路線
+        self.stop_to_routes = {
+            stop_name: set(zip(group['route_name'], group['direction_text']))
+            for stop_name, group in self.df.groupby('stop_name')
+        }
 
     def find_routes(self, origin, destination):
         """尋找包含出發站與目的站的有效路線"""
         results = []
-        for (route_name, direction), group in self.df.groupby(['route_name', 'direction_text']):
-            stops = group.sort_values('stop_number')['stop_name'].tolist()
-            if origin in stops and destination in stops:
-                if stops.index(origin) < stops.index(destination):
-                    results.append({
-                        'route_name': route_name,
-                        'direction_text': direction,
-                        'stops': stops[stops.index(origin):stops.index(destination)+1]
-                    })
+        candidates = self.stop_to_routes.get(origin, set()) & self.stop_to_routes.get(destination, set())
+        for route_name, direction in sorted(candidates):
+            stops = self.by_route[(route_name, direction)]
+            mask_o = stops.eq(origin)
+            mask_d = stops.eq(destination)
+            start, end = mask_o.idxmax(), mask_d.idxmax()
+            if start < end:
+                results.append({
+                    'route_name': route_name,
+                    'direction_text': direction,
+                    'stops': stops.iloc[start:end+1].tolist()
+                })
         return results
 
 def main():
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+台北市公車動態網頁 (ebus.gov.taipei) 共用的 HTML 解析工具。
+"""
+from lxml import html
+
+try:
+    # google-re2 以 DFA 線性時間比對，避免 .*? 在整頁 HTML 上回溯
+    import re2 as _regex
+except ImportError:
+    import re as _regex
+
+# re2 沒有 DOTALL 旗標常數，兩種引擎皆以樣式開頭的 (?s) 開啟
+
+# 路線列表頁：<li><a href="javascript:go('路線ID')">路線名稱</a></li>
+ROUTE_LIST_RE = _regex.compile(r'(?s)<li><a href="javascript:go\(\'(.*?)\'\)">(.*?)</a></li>')
+
+# 路線站點頁：每個站點是一個含有站序 span 的 <li>
+STOP_PLACE_SELECTOR = 'span.auto-list-stationlist-place'
+
+# 供 Playwright 使用：點擊回程不會換頁，去程列表也已渲染，
+# 先以 STOP_PLACES_JS 記下整串站名，等 STOP_PLACES_CHANGED_JS 判斷整串站名改變才代表回程列表已換上
+# （只比第一站會在回程起點與去程同名時永遠等不到）
+STOP_PLACES_JS = (
+    "(selector) => Array.from(document.querySelectorAll(selector), el => el.textContent).join('\\n')"
+)
+STOP_PLACES_CHANGED_JS = (
+    "([selector, before]) => {"
+    " const names = Array.from(document.querySelectorAll(selector), el => el.textContent).join('\\n');"
+    " return names !== '' && names !== before; }"
+)
+
+_STOP_ITEM_XPATH = '//li[.//span[contains(@class, "auto-list-stationlist-number")]]'
+
+
+def parse_stops_of_route(content: str) -> list:
+    """
+    以 lxml 解析路線站點頁，回傳 (到站資訊, 站序, 站名, 站點 ID, 緯度, 經度) 的 tuple 列表。
+    缺少站點 ID 或經緯度的 <li> 會被略過。
+    """
+    tree = html.fromstring(content)
+    rows = []
+    for item in tree.xpath(_STOP_ITEM_XPATH):
+        stop_id = item.xpath('.//input[@name="item.UniStopId"]/@value')
+        latitude = item.xpath('.//input[@name="item.Latitude"]/@value')
+        longitude = item.xpath('.//input[@name="item.Longitude"]/@value')
+        if not (stop_id and latitude and longitude):
+            continue
+        rows.append((
+            item.xpath('string(.//span[contains(@class, "auto-list-stationlist-position")])'),
+            item.xpath('string(.//span[contains(@class, "auto-list-stationlist-number")])').strip(),
+            item.xpath('string(.//span[contains(@class, "auto-list-stationlist-place")])'),
+            stop_id[0],
+            latitude[0],
+            longitude[0],
+        ))
+    return rows
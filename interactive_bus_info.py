@@ -1,9 +1,9 @@
 import os
-import re
 import pandas as pd
 from sqlalchemy import create_engine, Column, Integer, String, Float
 from sqlalchemy.orm import sessionmaker, declarative_base
 from playwright.sync_api import sync_playwright
+from ebus_parser import STOP_PLACE_SELECTOR, STOP_PLACES_JS, STOP_PLACES_CHANGED_JS, parse_stops_of_route
 
 Base = declarative_base()
 
@@ -42,16 +42,20 @@ class taipei_route_info:
             browser = p.chromium.launch(headless=True)
             page = browser.new_page()
             page.goto(self.url)
+            page.wait_for_selector('span.auto-list-stationlist-number', state='attached', timeout=10000)
 
             # 如果是回程，點擊回程按鈕
             if self.direction == 'come':
                 try:
+                    before = page.evaluate(STOP_PLACES_JS, STOP_PLACE_SELECTOR)
                     page.click('a.stationlist-come-go-gray.stationlist-come', timeout=5000)
-                    page.wait_for_timeout(1000)  # 給予時間讓頁面內容更新
+                    # 等整串站名換掉，確定畫面已是回程站點
+                    page.wait_for_function(STOP_PLACES_CHANGED_JS, arg=[STOP_PLACE_SELECTOR, before], timeout=10000)
                 except Exception as e:
-                    print(f"❌ 點擊回程按鈕失敗或未找到按鈕: {e}")
-            
-            page.wait_for_timeout(3000)  # 等待頁面載入和渲染
+                    print(f"❌ 切換到回程失敗: {e}")
+                    browser.close()
+                    return
+
             self.content = page.content()
             browser.close()
 
@@ -59,30 +63,23 @@ class taipei_route_info:
         """
         從抓取的 HTML 內容中解析公車站點的詳細資訊。
         """
-        pattern = re.compile(
-            r'<li>.*?<span class="auto-list-stationlist-position.*?">(.*?)</span>\s*'
-            r'<span class="auto-list-stationlist-number">\s*(\d+)</span>\s*'
-            r'<span class="auto-list-stationlist-place">(.*?)</span>.*?'
-            r'<input[^>]+name="item\.UniStopId"[^>]+value="(\d+)"[^>]*>.*?'
-            r'<input[^>]+name="item\.Latitude"[^>]+value="([\d\.]+)"[^>]*>.*?'
-            r'<input[^>]+name="item\.Longitude"[^>]+value="([\d\.]+)"[^>]*>',
-            re.DOTALL
-        )
-        matches = pattern.findall(self.content)
+        # 切換回程失敗時沒有內容，視同查無站點，避免把去程當成回程顯示
+        rows = parse_stops_of_route(self.content) if self.content else []
 
-        if not matches:
+        if not rows:
             print(f"❌ 路線 {self.route_id} ({'去程' if self.direction == 'go' else '回程'}) 未找到站點資料。")
             return pd.DataFrame()
 
         self.dataframe = pd.DataFrame(
-            matches,
+            rows,
             columns=["arrival_info", "stop_number", "stop_name", "stop_id", "latitude", "longitude"]
         )
         self.dataframe["direction"] = self.direction
         self.dataframe["route_id"] = self.route_id
         
-        self.dataframe["latitude"] = self.dataframe["latitude"].astype(float)
-        self.dataframe["longitude"] = self.dataframe["longitude"].astype(float)
+        self.dataframe = self.dataframe.astype({
+            "latitude": "float64", "longitude": "float64", "stop_number": "int32", "stop_id": "int64"
+        })
         
         print(f"✅ 路線 {self.route_id} ({'去程' if self.direction == 'go' else '回程'}) 成功解析 {len(self.dataframe)} 個站點。")
         return self.dataframe
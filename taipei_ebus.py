@@ -5,9 +5,9 @@ import os
 import re
 import pandas as pd
 from playwright.sync_api import sync_playwright
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base, scoped_session
-from sqlalchemy import Column, String, Float, Integer
+from sqlalchemy import Column, String, Float, Integer, Index
 
 # 設定標準輸出編碼為 UTF-8，以避免中文字符亂碼問題
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
@@ -30,6 +30,16 @@ class bus_stop_orm(Base):
     longitude = Column(Float)
     direction = Column(String, primary_key=True)
     route_id = Column(String, primary_key=True)
+    # get_bus_info 以站名查詢，避免掃描整張站點表
+    __table_args__ = (Index('ix_busstop_stop_name', 'stop_name'),)
+
+def create_schema(engine):
+    """
+    建立資料表與索引。create_all 不會替已存在的資料表補索引，舊資料庫的索引在此另外建立。
+    """
+    Base.metadata.create_all(engine)
+    for index in bus_stop_orm.__table__.indexes:
+        index.create(engine, checkfirst=True)
 
 class taipei_route_list:
     """
@@ -48,7 +58,7 @@ class taipei_route_list:
         self.engine = create_engine(f'sqlite:///{self.working_directory}/hermes_ebus_taipei.sqlite3')
         # 連接資料庫並創建表格（如果不存在）
         self.engine.connect()
-        Base.metadata.create_all(self.engine)
+        create_schema(self.engine)
         # 創建資料庫會話
         Session = sessionmaker(bind=self.engine)
         self.session = Session()
@@ -218,7 +228,7 @@ class taipei_route_info:
         將解析後的公車站點資料儲存到 SQLite 資料庫。
         這裡接收 engine 和 Base 參數，以便重用主程式的資料庫連接，避免重複建立。
         """
-        Base.metadata.create_all(engine) # 確保表格存在
+        create_schema(engine) # 確保表格與索引存在
         Session = sessionmaker(bind=engine)
         session = Session()
 
@@ -243,30 +253,36 @@ def get_bus_info(start_stop: str, end_stop: str, direction: str):
     """
     # 初始化資料庫連線
     engine = create_engine('sqlite:///data/hermes_ebus_taipei.sqlite3')
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-    # 查詢所有公車路線
-    routes = session.query(bus_route_orm).all()
-    for route in routes:
-        # 查詢該路線的站點資料
-        query = f"""
-        SELECT * FROM data_route_info_busstop
-        WHERE route_id = '{route.route_id}' AND direction = '{direction}'
-        """
-        df = pd.read_sql(query, engine)
-
-        # 檢查開始站和目標站是否在該路線中
-        if start_stop in df["stop_name"].values and end_stop in df["stop_name"].values:
-            start_stop_info = df[df["stop_name"] == start_stop].iloc[0]
-            end_stop_info = df[df["stop_name"] == end_stop].iloc[0]
-
-            print(f"\n需要搭乘的公車：{route.route_name}")
-            print(f"開始站：{start_stop_info['stop_name']}，到站資訊：{start_stop_info['arrival_info']}")
-            print(f"目標站：{end_stop_info['stop_name']}，到站資訊：{end_stop_info['arrival_info']}")
-            return
 
-    print("❌ 未找到符合條件的公車路線。")
+    # 一次查詢找出同時經過兩站的路線，取代逐條路線查詢站點資料；
+    # 同一路線站名重複時，取站序最小的那一站
+    query = text("""
+    WITH first_stops AS (
+        SELECT route_id, stop_name, arrival_info,
+               ROW_NUMBER() OVER (PARTITION BY route_id, stop_name ORDER BY stop_number) AS rn
+        FROM data_route_info_busstop
+        WHERE direction = :direction AND stop_name IN (:start_stop, :end_stop)
+    )
+    SELECT r.route_name,
+           s.arrival_info AS start_arrival_info,
+           e.arrival_info AS end_arrival_info
+    FROM first_stops s
+    JOIN first_stops e ON e.route_id = s.route_id AND e.stop_name = :end_stop AND e.rn = 1
+    JOIN data_route_list r ON r.route_id = s.route_id
+    WHERE s.stop_name = :start_stop AND s.rn = 1
+    ORDER BY r.rowid
+    LIMIT 1
+    """)
+    with engine.connect() as conn:
+        row = conn.execute(query, {"start_stop": start_stop, "end_stop": end_stop, "direction": direction}).first()
+
+    if row is None:
+        print("❌ 未找到符合條件的公車路線。")
+        return
+
+    print(f"\n需要搭乘的公車：{row.route_name}")
+    print(f"開始站：{start_stop}，到站資訊：{row.start_arrival_info}")
+    print(f"目標站：{end_stop}，到站資訊：{row.end_arrival_info}")
 
 # --- 主執行區塊 ---
 if __name__ == "__main__":
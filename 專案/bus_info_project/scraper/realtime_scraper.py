@@ -5,12 +5,21 @@ Retrieves Taipei eBus route and stop data, stores it in SQLite, and optionally s
 
 import os
 import re
+import asyncio
+import atexit
 import enum
+import functools
 import logging
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import httpx
 import pandas as pd
 from playwright.sync_api import sync_playwright
-from sqlalchemy import create_engine, Column, String, Float, Integer, Enum
+from playwright.async_api import async_playwright
+from selectolax.lexbor import LexborHTMLParser
+from sqlalchemy import create_engine, event, update, Column, String, Float, Integer, Enum
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 # 設定日誌紀錄
 logging.basicConfig(filename='ebus_error.log', level=logging.ERROR, format='%(asctime)s - %(message)s')
@@ -41,36 +50,246 @@ class StopORM(Base):
     route_id = Column(String, primary_key=True)
 
 
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # 爬蟲資料可重抓，寫入時不需要 fsync 與磁碟 journal
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.execute("PRAGMA journal_mode=MEMORY")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
+
+
+Session = sessionmaker()
+
+
+@functools.lru_cache(maxsize=None)
+def get_engine(working_directory='data'):
+    """
+    每個工作目錄在整個程序中只建立一次 engine，並在此時執行一次 create_all。
+    使用預設連線池，各 session 有各自的連線與交易，不會互相 commit 對方的資料。
+    """
+    engine = create_engine(f'sqlite:///{working_directory}/hermes_ebus_taipei.sqlite3')
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+HTTP_HEADERS = {"User-Agent": "Mozilla/5.0"}
+STOPS_OF_ROUTE_URL = 'https://ebus.gov.taipei/Route/StopsOfRoute?routeid={route_id}'
+# 專案內的 Playwright 瀏覽器快取，先以
+#   PLAYWRIGHT_BROWSERS_PATH=<此目錄> playwright install chromium
+# 下載一次；目錄存在時才採用，並保留使用者自行設定的環境變數
+PLAYWRIGHT_BROWSERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".playwright-browsers")
+if os.path.isdir(PLAYWRIGHT_BROWSERS_DIR):
+    os.environ.setdefault("PLAYWRIGHT_BROWSERS_PATH", PLAYWRIGHT_BROWSERS_DIR)
+
+# 無頭爬蟲用不到 GPU、沙箱、擴充功能與背景服務，關掉以加快啟動並降低記憶體
+CHROMIUM_LAUNCH_ARGS = [
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-sync',
+    '--no-first-run',
+    '--mute-audio',
+]
+
+# 站點列表渲染完成的標記，取代固定等待 3 秒
+STOP_NUMBER_SELECTOR = 'span.auto-list-stationlist-number'
+STOP_PLACE_SELECTOR = 'span.auto-list-stationlist-place'
+COME_TAB_SELECTOR = 'a.stationlist-come-go-gray.stationlist-come'
+# 點擊回程不會換頁，去程列表也早已渲染；整串站名與點擊前不同才代表回程列表已換上
+# （只比第一站會在回程起點與去程同名時永遠等不到）
+_STOP_PLACES_JS = (
+    "(selector) => Array.from(document.querySelectorAll(selector), el => el.textContent).join('\\n')"
+)
+_STOP_PLACES_CHANGED_JS = (
+    "([selector, before]) => {"
+    " const names = Array.from(document.querySelectorAll(selector), el => el.textContent).join('\\n');"
+    " return names !== '' && names !== before; }"
+)
+
+# parse_route_info 產生的 tuple 欄位順序，寫入資料庫時照此順序對應
+STOP_COLUMNS = ("arrival_info", "stop_number", "stop_name", "stop_id", "latitude", "longitude", "direction", "route_id")
+_STOP_KEY_COLUMNS = ("stop_number", "direction", "route_id")
+_UPSERT_STOPS_SQL = (
+    f"INSERT INTO {StopORM.__tablename__} ({', '.join(STOP_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(STOP_COLUMNS))}) "
+    f"ON CONFLICT ({', '.join(_STOP_KEY_COLUMNS)}) DO UPDATE SET "
+    + ", ".join(f"{c}=excluded.{c}" for c in STOP_COLUMNS if c not in _STOP_KEY_COLUMNS)
+)
+
+# 路線列表的正規表示式只在載入模組時編譯一次
+_ROUTE_LIST_RE = re.compile(r'<li><a href="javascript:go\(\'(.*?)\'\)">(.*?)</a></li>', re.DOTALL)
+
+
+# 存檔用的背景執行緒，寫 HTML 時不必等磁碟 I/O；程序結束前 concurrent.futures 會等待寫完
+_io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="html-writer")
+
+
+def _write_bytes(path, data):
+    with open(path, 'wb', buffering=1 << 20) as file:
+        file.write(data)
+
+
+def _log_write_error(path, future):
+    # 背景寫檔的例外不會傳回呼叫端，在這裡記錄下來
+    error = future.exception()
+    if error is not None:
+        print(f"[Error] Saving {path} failed: {error}")
+        logging.error(f"Saving {path} failed with error: {error}")
+
+
+def _save_in_background(path, data):
+    future = _io_pool.submit(_write_bytes, path, data)
+    future.add_done_callback(functools.partial(_log_write_error, path))
+    return future
+
+
+def bulk_upsert_stops(conn, rows, batch=500):
+    """
+    以 DBAPI (sqlite3) 連線的 executemany 每 batch 筆寫入一次站點，略過 ORM 的逐列處理。
+    rows 為依 STOP_COLUMNS 排列的 tuple；交易由呼叫端負責 commit。
+    """
+    for start in range(0, len(rows), batch):
+        conn.executemany(_UPSERT_STOPS_SQL, rows[start:start + batch])
+
+
+class BrowserPool:
+    """
+    整個程序共用一個 Chromium 與 context，第一次取用時才啟動，程序結束時由 atexit 關閉。
+    """
+    _instance = None
+
+    def __init__(self):
+        self._playwright = sync_playwright().start()
+        self.browser = self._playwright.chromium.launch(
+            headless=True, args=CHROMIUM_LAUNCH_ARGS, chromium_sandbox=False
+        )
+        self.context = self.browser.new_context()
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+            atexit.register(cls._instance.close)
+        return cls._instance
+
+    def new_context(self):
+        return self.browser.new_context()
+
+    def new_page(self):
+        return self.context.new_page()
+
+    def close(self):
+        self.context.close()
+        self.browser.close()
+        self._playwright.stop()
+        if BrowserPool._instance is self:
+            BrowserPool._instance = None
+
+
+def fetch_html(url, http_client=None, raw=False):
+    """
+    路線列表與站點頁皆由伺服器端產生，直接 HTTP GET 即可，不需啟動瀏覽器。
+    raw=True 時回傳未解碼的 bytes，可直接交給 selectolax 解析。
+    """
+    if http_client is None:
+        with httpx.Client(headers=HTTP_HEADERS, follow_redirects=True, timeout=10) as client:
+            return fetch_html(url, client, raw)
+    response = http_client.get(url)
+    response.raise_for_status()
+    return response.content if raw else response.text
+
+
+async def fetch_route_pages(route_ids, direction='go', concurrency=8, use_browser=False):
+    """
+    同時抓取多條路線的站點頁，最多 concurrency 個請求並行。
+    回傳 {route_id: HTML 或 Exception}，單一路線失敗不影響其他路線；HTTP 抓取的 HTML 為未解碼的 bytes。
+    回程需要點擊頁面按鈕切換，與 use_browser=True 時一樣改用 Chromium。
+    """
+    if use_browser or direction == 'come':
+        return await _fetch_route_pages_with_browser(route_ids, direction, concurrency)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(headers=HTTP_HEADERS, follow_redirects=True, timeout=10) as client:
+        async def fetch_one(route_id):
+            async with semaphore:
+                response = await client.get(STOPS_OF_ROUTE_URL.format(route_id=route_id))
+                response.raise_for_status()
+                return response.content
+
+        results = await asyncio.gather(*(fetch_one(route_id) for route_id in route_ids), return_exceptions=True)
+
+    return dict(zip(route_ids, results))
+
+
+async def _fetch_route_pages_with_browser(route_ids, direction, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=CHROMIUM_LAUNCH_ARGS, chromium_sandbox=False)
+        context = await browser.new_context()
+
+        async def fetch_one(route_id):
+            async with semaphore:
+                page = await context.new_page()
+                try:
+                    await page.goto(STOPS_OF_ROUTE_URL.format(route_id=route_id))
+                    await page.wait_for_selector(STOP_NUMBER_SELECTOR, state='attached', timeout=5000)
+                    if direction == 'come':
+                        before = await page.evaluate(_STOP_PLACES_JS, STOP_PLACE_SELECTOR)
+                        await page.click(COME_TAB_SELECTOR)
+                        await page.wait_for_function(
+                            _STOP_PLACES_CHANGED_JS, arg=[STOP_PLACE_SELECTOR, before], timeout=5000
+                        )
+                    return await page.content()
+                finally:
+                    await page.close()
+
+        results = await asyncio.gather(*(fetch_one(route_id) for route_id in route_ids), return_exceptions=True)
+        await browser.close()
+
+    return dict(zip(route_ids, results))
+
+
 class taipei_route_list:
-    def __init__(self, working_directory='data'):
+    def __init__(self, working_directory='data', use_browser=False, save_html=False):
         self.working_directory = working_directory
+        self.use_browser = use_browser
+        self.save_html = save_html
         os.makedirs(self.working_directory, exist_ok=True)
         self.url = 'https://ebus.gov.taipei/ebus?ct=all'
         self.content = None
         self._fetch_content()
 
-        self.engine = create_engine(f'sqlite:///{self.working_directory}/hermes_ebus_taipei.sqlite3')
-        self.engine.connect()
-        Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        self.engine = get_engine(self.working_directory)
+        self.session = Session(bind=self.engine)
 
-    def _fetch_content(self):
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
+    def _fetch_content(self, page=None):
+        if self.use_browser or page is not None:
+            self._fetch_content_with_browser(page)
+        else:
+            self.content = fetch_html(self.url)
+
+        if self.save_html:
+            html_file_path = f'{self.working_directory}/hermes_ebus_taipei_route_list.html'
+            _save_in_background(html_file_path, self.content.encode("utf-8"))
+
+    def _fetch_content_with_browser(self, page=None):
+        page = page or BrowserPool.get().new_page()
+        try:
             page.goto(self.url)
-            page.wait_for_timeout(3000)
+            page.wait_for_selector('li a[href^="javascript:go"]', state='attached', timeout=5000)
             self.content = page.content()
-            browser.close()
-
-        html_file_path = f'{self.working_directory}/hermes_ebus_taipei_route_list.html'
-        with open(html_file_path, "w", encoding="utf-8") as file:
-            file.write(self.content)
+        finally:
+            page.close()
 
     def parse_route_list(self):
-        pattern = r'<li><a href="javascript:go\(\'(.*?)\'\)">(.*?)</a></li>'
-        matches = re.findall(pattern, self.content, re.DOTALL)
+        matches = _ROUTE_LIST_RE.findall(self.content)
         if not matches:
             raise ValueError("No data found for route table")
         bus_routes = [(route_id, route_name.strip()) for route_id, route_name in matches]
@@ -78,98 +297,186 @@ class taipei_route_list:
         return self.dataframe
 
     def save_to_database(self):
-        for _, row in self.dataframe.iterrows():
-            self.session.merge(RouteORM(route_id=row['route_id'], route_name=row['route_name']))
+        # 所有路線以一次 executemany 寫入；只新增尚未存在的路線，已存在的整列不動，保留處理狀態
+        stmt = sqlite_insert(RouteORM.__table__).on_conflict_do_nothing(index_elements=['route_id'])
+        self.session.execute(stmt, self.dataframe.to_dict(orient="records"))
         self.session.commit()
 
     def read_from_database(self):
         df = pd.read_sql(self.session.query(RouteORM).statement, self.session.bind)
         return df
 
-    def set_route_status(self, route_id, status: RouteStatus):
+    def get_pending_route_ids(self):
+        # 在 SQL 端篩選，只取回尚未處理路線的 route_id
+        rows = self.session.query(RouteORM.route_id).filter(RouteORM.route_data_updated == RouteStatus.pending).all()
+        return [r[0] for r in rows]
+
+    def set_route_status(self, route_id, status: RouteStatus, commit=True):
         self.session.query(RouteORM).filter_by(route_id=route_id).update({"route_data_updated": status})
-        self.session.commit()
+        if commit:
+            self.session.commit()
+
+    def set_routes_status(self, status_by_route, commit=True):
+        # 依狀態分組，每種狀態只下一次 UPDATE ... WHERE route_id IN (...)
+        route_ids_by_status = {}
+        for route_id, status in status_by_route.items():
+            route_ids_by_status.setdefault(status, []).append(route_id)
+        for status, route_ids in route_ids_by_status.items():
+            self.session.execute(
+                update(RouteORM).where(RouteORM.route_id.in_(route_ids)).values(route_data_updated=status)
+            )
+        if commit:
+            self.session.commit()
 
     def __del__(self):
+        # engine 由 get_engine 共用，這裡只關閉自己的 session
         self.session.close()
-        self.engine.dispose()
 
 
 class taipei_route_info:
-    def __init__(self, route_id, direction='go', working_directory='data', save_html=False):
+    def __init__(self, route_id, direction='go', working_directory='data', save_html=False, content=None,
+                 use_browser=False, session=None):
         self.route_id = route_id
+        self.session = session
         self.direction = direction
-        self.content = None
-        self.url = f'https://ebus.gov.taipei/Route/StopsOfRoute?routeid={route_id}'
+        self.use_browser = use_browser
+        self.content = content
+        self.rows = None
+        self._dataframe = None
+        self.url = STOPS_OF_ROUTE_URL.format(route_id=route_id)
         self.working_directory = working_directory
         self.save_html = save_html
 
         if self.direction not in ['go', 'come']:
             raise ValueError("Direction must be 'go' or 'come'")
 
-        self._fetch_content()
-
-    def _fetch_content(self):
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
+        # 已由 fetch_route_pages 批次抓好的頁面直接使用，不再另開瀏覽器
+        if self.content is None:
+            self._fetch_content()
+        else:
+            self._save_html()
+
+    def _fetch_content(self, page=None):
+        if self.use_browser or self.direction == 'come' or page is not None:
+            self._fetch_content_with_browser(page)
+        else:
+            self.content = fetch_html(self.url, raw=True)
+        self._save_html()
+
+    def _fetch_content_with_browser(self, page=None):
+        page = page or BrowserPool.get().new_page()
+        try:
             page.goto(self.url)
+            page.wait_for_selector(STOP_NUMBER_SELECTOR, state='attached', timeout=5000)
 
             if self.direction == 'come':
-                page.click('a.stationlist-come-go-gray.stationlist-come')
+                # 逾時代表沒有切換到回程，寧可丟出例外也不要把去程站點存成回程
+                before = page.evaluate(_STOP_PLACES_JS, STOP_PLACE_SELECTOR)
+                page.click(COME_TAB_SELECTOR)
+                page.wait_for_function(_STOP_PLACES_CHANGED_JS, arg=[STOP_PLACE_SELECTOR, before], timeout=5000)
 
-            page.wait_for_timeout(3000)
             self.content = page.content()
-            browser.close()
+        finally:
+            page.close()
 
+    def _save_html(self):
         if self.save_html:
             html_file = f"{self.working_directory}/ebus_taipei_{self.route_id}_{self.direction}.html"
-            with open(html_file, "w", encoding="utf-8") as file:
-                file.write(self.content)
+            data = self.content.encode("utf-8") if isinstance(self.content, str) else self.content
+            _save_in_background(html_file, data)
 
     def parse_route_info(self):
-        pattern = re.compile(
-            r'<li>.*?<span class="auto-list-stationlist-position.*?">(.*?)</span>\s*'
-            r'<span class="auto-list-stationlist-number">\s*(\d+)</span>\s*'
-            r'<span class="auto-list-stationlist-place">(.*?)</span>.*?'
-            r'<input[^>]+name="item\.UniStopId"[^>]+value="(\d+)"[^>]*>.*?'
-            r'<input[^>]+name="item\.Latitude"[^>]+value="([\d\.]+)"[^>]*>.*?'
-            r'<input[^>]+name="item\.Longitude"[^>]+value="([\d\.]+)"[^>]*>',
-            re.DOTALL
-        )
-        matches = pattern.findall(self.content)
-        if not matches:
+        """
+        解析站點頁（str 或 bytes 皆可），回傳依 STOP_COLUMNS 排列、已轉好型別的 tuple 列表，不建立 DataFrame。
+        """
+        # 解析後已釋放 HTML，重複呼叫時直接回傳先前的結果
+        if self.content is None:
+            if self.rows is not None:
+                return self.rows
+            raise ValueError(f"No HTML content to parse for route ID {self.route_id}")
+
+        # 以 selectolax 走訪 DOM，每個含站序的 <li> 取出六個欄位，避免 DOTALL 正規表示式的回溯
+        rows = []
+        for item in LexborHTMLParser(self.content).css('li'):
+            number = item.css_first(STOP_NUMBER_SELECTOR)
+            position = item.css_first('span.auto-list-stationlist-position')
+            place = item.css_first('span.auto-list-stationlist-place')
+            stop_id = item.css_first('input[name="item.UniStopId"]')
+            latitude = item.css_first('input[name="item.Latitude"]')
+            longitude = item.css_first('input[name="item.Longitude"]')
+            if None in (number, position, place, stop_id, latitude, longitude):
+                continue
+            rows.append((
+                position.text(),
+                int(number.text(strip=True)),
+                place.text(),
+                int(stop_id.attributes['value']),
+                float(latitude.attributes['value']),
+                float(longitude.attributes['value']),
+                self.direction,
+                self.route_id,
+            ))
+        if not rows:
             raise ValueError(f"No data found for route ID {self.route_id}")
 
-        self.dataframe = pd.DataFrame(matches, columns=[
-            "arrival_info", "stop_number", "stop_name", "stop_id", "latitude", "longitude"
-        ])
-        self.dataframe["direction"] = self.direction
-        self.dataframe["route_id"] = self.route_id
-        self.dataframe["latitude"] = self.dataframe["latitude"].astype(float)
-        self.dataframe["longitude"] = self.dataframe["longitude"].astype(float)
-        self.dataframe["stop_number"] = self.dataframe["stop_number"].astype(int)
-        return self.dataframe
-
-    def save_to_database(self):
-        engine = create_engine(f"sqlite:///{self.working_directory}/hermes_ebus_taipei.sqlite3")
-        Base.metadata.create_all(engine)
-        Session = sessionmaker(bind=engine)
-        session = Session()
-
-        for _, row in self.dataframe.iterrows():
-            session.merge(StopORM(
-                stop_id=row["stop_id"],
-                arrival_info=row["arrival_info"],
-                stop_number=row["stop_number"],
-                stop_name=row["stop_name"],
-                latitude=row["latitude"],
-                longitude=row["longitude"],
-                direction=row["direction"],
-                route_id=row["route_id"]
-            ))
-        session.commit()
-        session.close()
+        # 解析完只保留 rows，不再持有整頁 HTML
+        self.content = None
+        self.rows = rows
+        self._dataframe = None
+        return self.rows
+
+    @property
+    def dataframe(self):
+        # 只有需要表格操作時才由 rows 建立 DataFrame，一次 astype 縮小數值欄位
+        if self._dataframe is None and self.rows is not None:
+            self._dataframe = pd.DataFrame(self.rows, columns=STOP_COLUMNS).astype({
+                "latitude": "float32", "longitude": "float32", "stop_number": "int32", "stop_id": "int64"
+            })
+        return self._dataframe
+
+    def save_to_database(self, session=None):
+        """
+        有 session（參數或建構時注入）時沿用其交易、由呼叫端 commit；否則以共用 engine 開一個交易立即寫入。
+        """
+        session = session or self.session
+        # 取出底層的 sqlite3 連線，tuple 直接交給 bulk_upsert_stops
+        if session is not None:
+            bulk_upsert_stops(session.connection().connection, self.rows)
+            return
+
+        with get_engine(self.working_directory).begin() as conn:
+            bulk_upsert_stops(conn.connection, self.rows)
+
+
+def _init_browser_worker():
+    global _io_pool
+    # fork 複製來的 _io_pool 沒有實際的執行緒，worker 另建自己的寫檔執行緒，行程結束前先等 HTML 寫完
+    _io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="html-writer")
+    multiprocessing.util.Finalize(None, _io_pool.shutdown, exitpriority=20)
+    # 每個 worker 行程啟動自己的 Chromium，處理多條路線時重複使用；行程結束時關閉
+    BrowserPool._instance = None
+    pool = BrowserPool.get()
+    multiprocessing.util.Finalize(None, pool.close, exitpriority=10)
+
+
+def _scrape_route_rows(route_id, direction, save_html):
+    return taipei_route_info(route_id, direction=direction, save_html=save_html, use_browser=True).parse_route_info()
+
+
+def scrape_routes_with_browser(route_ids, direction='go', max_workers=4, save_html=False):
+    """
+    以多個行程各自的瀏覽器抓取並解析路線，回傳 {route_id: rows 或 Exception}。
+    worker 不碰資料庫，寫入仍由主行程的單一連線負責。
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_browser_worker) as executor:
+        futures = {route_id: executor.submit(_scrape_route_rows, route_id, direction, save_html) for route_id in route_ids}
+        for route_id, future in futures.items():
+            try:
+                results[route_id] = future.result()
+            except Exception as e:
+                results[route_id] = e
+    return results
 
 
 if __name__ == "__main__":
@@ -178,21 +485,49 @@ if __name__ == "__main__":
     route_list.save_to_database()
 
     # 從資料庫自動抓取未處理的路線
-    pending_routes = route_list.read_from_database()
-    bus_list = pending_routes[pending_routes['route_data_updated'] == 'pending']['route_id'].tolist()
+    bus_list = route_list.get_pending_route_ids()
+
+    # 先並行抓完所有頁面，再依序解析寫入
+    pages = asyncio.run(fetch_route_pages(bus_list, direction="go"))
 
+    # 先解析 HTTP 抓到的頁面；請求失敗或頁面解析不出站點（ValueError）的路線，
+    # 改由多個瀏覽器行程重試，worker 直接回傳解析好的 rows
+    rows_by_route = {}
+    retry_ids = []
     for route_id in bus_list:
+        # pop 後 pages 不再持有該頁，解析完 HTML 即可釋放
+        content = pages.pop(route_id)
+        if isinstance(content, Exception):
+            retry_ids.append(route_id)
+            continue
         try:
-            route_info = taipei_route_info(route_id, direction="go", save_html=True)
-            route_info.parse_route_info()
-            route_info.save_to_database()
+            route_info = taipei_route_info(route_id, direction="go", save_html=True, content=content)
+            rows_by_route[route_id] = route_info.parse_route_info()
+        except ValueError:
+            retry_ids.append(route_id)
+        except Exception as e:
+            rows_by_route[route_id] = e
+    if retry_ids:
+        rows_by_route.update(scrape_routes_with_browser(retry_ids, direction="go", save_html=True))
+
+    # 所有路線的站點與狀態都寫在 route_list.session 的同一個交易中，最後只 commit 一次
+    status_by_route = {}
+    for route_id in bus_list:
+        try:
+            rows = rows_by_route[route_id]
+            if isinstance(rows, Exception):
+                raise rows
+            bulk_upsert_stops(route_list.session.connection().connection, rows)
 
             print(f"\n[Route ID: {route_id}]")
-            for index, row in route_info.dataframe.iterrows():
-                print(f"Stop #{row['stop_number']}: {row['stop_name']} (Lat: {row['latitude']}, Lon: {row['longitude']})")
+            for arrival_info, stop_number, stop_name, stop_id, latitude, longitude, *_ in rows:
+                print(f"Stop #{stop_number}: {stop_name} (Lat: {latitude}, Lon: {longitude})")
 
-            route_list.set_route_status(route_id, RouteStatus.updated)
+            status_by_route[route_id] = RouteStatus.updated
         except Exception as e:
             print(f"[Error] Route {route_id} failed: {e}")
             logging.error(f"Route {route_id} failed with error: {e}")
-            route_list.set_route_status(route_id, RouteStatus.failed)
+            status_by_route[route_id] = RouteStatus.failed
+
+    route_list.set_routes_status(status_by_route, commit=False)
+    route_list.session.commit()